@@ -10,27 +10,64 @@ IGUV Weekly Updater – Prompt-basierte Variante (schlankes HTML, ohne Design)
 - Füllt 'Next Events' ggf. via einfachem Scraper von https://iguv.ch/event/
 """
 
-import os, sys, re, html, time, traceback
+import os, sys, re, html, json, gzip, time, random, hashlib, logging, functools, threading
 from datetime import datetime, date
-from typing import List, Dict, Any, Optional
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Tuple
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib.parse import urljoin
+from lxml import etree, html as lh
+
+log = logging.getLogger("iguv-weekly")
 
 # ================== ENV ==================
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "").strip()
 OPENAI_MODEL   = (os.getenv("OPENAI_MODEL", "") or "gpt-5").strip()
 OPENAI_REQUEST_TIMEOUT_S = int(os.getenv("OPENAI_REQUEST_TIMEOUT_S", "300"))
 USE_WEBSEARCH  = os.getenv("USE_OPENAI_WEBSEARCH", "1").lower() not in ("0","false","off")
+# Letzter Versuch ohne Websuche (schneller, aber ohne aktuelle Recherche) – nur auf Wunsch
+WEBSEARCH_FALLBACK = os.getenv("OPENAI_NO_WEBSEARCH_FALLBACK", "0").lower() in ("1","true","on")
 
 WP_BASE         = (os.getenv("WP_BASE", "") or "").rstrip("/")
 WP_USERNAME     = os.getenv("WP_USERNAME", "")
 WP_APP_PASSWORD = os.getenv("WP_APP_PASSWORD", "")
 WP_API_TOKEN    = os.getenv("WP_API_TOKEN", "")  # optional
+WP_GZIP         = os.getenv("WP_GZIP", "0").lower() in ("1","true","on")  # Request-Body gzip-komprimieren
+WP_SKIP_UNCHANGED = os.getenv("WP_SKIP_UNCHANGED", "1").lower() not in ("0","false","off")  # gleicher Inhalt → kein POST
+
+EVENTS_COUNT = int(os.getenv("EVENTS_COUNT", "5"))  # 0 = Event-Seite nicht laden (keine Ergänzung)
 
-EVENTS_COUNT = int(os.getenv("EVENTS_COUNT", "5"))
+# Lokaler Cache (OpenAI-Antworten, Event-Seite); in der Action via actions/cache zwischen Läufen erhalten
+CACHE_DIR = Path(os.getenv("CACHE_DIR", ".cache"))
+OPENAI_CACHE = os.getenv("OPENAI_CACHE", "1").lower() not in ("0","false","off")
+OPENAI_CACHE_TTL_S = 6 * 24 * 3600  # < 7 Tage: der nächste Wochenlauf fragt immer neu an
 
 USER_AGENT = "Mozilla/5.0 (compatible; IGUV-Weekly-Updater/Prompt-Mode; +https://iguv.ch)"
 REQ_TIMEOUT = 45
+MAX_BODY_BYTES = 2 * 1024 * 1024
+RETRY_AFTER_MAX_S = 300.0  # Obergrenze für Retry-After (Session-Retries + OpenAI-Backoff)
+
+class _CappedRetry(Retry):
+    """Retry mit gedeckeltem Retry-After: urllib3 würde sonst bis zu 6 h schlafen (Job-Timeout)."""
+    def get_retry_after(self, response):
+        ra = super().get_retry_after(response)
+        return None if ra is None else min(ra, RETRY_AFTER_MAX_S)
+
+# Eine Session für alle HTTP-Calls: Keep-Alive/TLS-Reuse (Event-Seite + WP liegen auf demselben Host)
+SESSION = requests.Session()
+SESSION.headers.update({"User-Agent": USER_AGENT})
+# POST darf mit: der WP-Endpoint überschreibt nur das Weekly-HTML (idempotent).
+# raise_on_status=False → nach dem letzten Versuch kommt die Antwort selbst zurück (Status/Text fürs Log)
+_ADAPTER = HTTPAdapter(
+    pool_connections=4, pool_maxsize=8,
+    max_retries=_CappedRetry(total=2, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504),
+                            allowed_methods=frozenset({"GET", "POST"}), raise_on_status=False),
+)
+SESSION.mount("https://", _ADAPTER)
+SESSION.mount("http://", _ADAPTER)
 
 def require_env():
     missing = []
@@ -46,103 +83,284 @@ def require_env():
         raise RuntimeError("Fehlende ENV Variablen: " + ", ".join(missing))
 
 # ================== Event-Scraper ==================
-DATE_RX_NUM = re.compile(r"(\d{1,2})\.(\d{1,2})\.(\d{4})")
 MONTHS_DE = {
     "januar":1,"februar":2,"maerz":3,"märz":3,"april":4,"mai":5,"juni":6,
     "juli":7,"august":8,"september":9,"oktober":10,"november":11,"dezember":12
 }
-DATE_RX_TEXT = re.compile(r"(\d{1,2})\.\s*([A-Za-zäöüÄÖÜ]+)\s*(\d{4})")
+# "12.03.2026" oder "12. März 2026" in einem Durchlauf; [0-9] statt \d (nur ASCII-Ziffern),
+# \s bleibt Unicode, da WordPress zwischen Tag und Monat oft &nbsp; setzt
+DATE_RX = re.compile(r"([0-9]{1,2})\.(?:([0-9]{1,2})\.|\s*([A-Za-zäöüÄÖÜ]+)\s*)([0-9]{4})")
+
+# XPath-Ausdrücke einmalig kompilieren (laufen komplett in lxml/C)
+TIME_XP    = etree.XPath("//time")
+# Nur Knoten mit eigenem Link: ohne Link gäbe es nur die Fallback-URL der Übersichtsseite.
+# Datum braucht einen Punkt im eigenen oder im Eltern-Text (Fallback) – Vorfilter läuft in libxml2
+# (bewusst contains() statt re:test – EXSLT-Regex ruft pro Knoten zurück nach Python)
+GENERIC_XP = etree.XPath("//*[self::article or self::li or self::div or self::span or self::a or self::dd or self::dt]"
+                         "[descendant-or-self::a[@href]][contains(., '.') or contains(.., '.')]")
+PARENT_XP  = etree.XPath("ancestor::*[self::article or self::li or self::div or self::section][1]")
+HREF_XP    = etree.XPath("(.//a[@href])[1]/@href")
+# Typische Event-Karten (Events Calendar, Elementor-Posts, Kalender-Widgets)
+# (Klassen-Match case-insensitiv via translate() – bleibt in libxml2, kein EXSLT-Regex)
+_CLASS_LC  = "translate(@class, 'ABCDEFGHIJKLMNOPQRSTUVWXYZ', 'abcdefghijklmnopqrstuvwxyz')"
+CARD_XP    = etree.XPath(f"//*[self::article or self::li][contains({_CLASS_LC}, 'event') or "
+                         f"contains({_CLASS_LC}, 'elementor-post') or contains({_CLASS_LC}, 'calendar')]")
+
+# Strukturierte Events (The Events Calendar u. a. liefern schema.org/Event als JSON-LD)
+JSONLD_XP  = etree.XPath("//script[@type='application/ld+json']/text()")
+
+def _iter_jsonld_events(obj):
+    """Alle schema.org-Events (auch *Event-Untertypen) aus einem JSON-LD-Objekt, inkl. @graph/Listen."""
+    if isinstance(obj, list):
+        for it in obj:
+            yield from _iter_jsonld_events(it)
+    elif isinstance(obj, dict):
+        types = obj.get("@type")
+        if any(isinstance(t, str) and t.endswith("Event") for t in (types if isinstance(types, list) else [types])):
+            yield obj
+        if "@graph" in obj:
+            yield from _iter_jsonld_events(obj["@graph"])
+
+def _abs_url(base: str, href: str) -> str:
+    return href if href.startswith(("https://", "http://")) else urljoin(base, href)
+
+def _text(el) -> str:
+    return " ".join(" ".join(el.itertext()).split())
+
+def _make_date(yyyy: int, mm: int, dd: int) -> Optional[date]:
+    # Offensichtlich ungültige Werte (z. B. Versionsnummern "3.14.2025") ohne Exception verwerfen
+    if not (1 <= mm <= 12 and 1 <= dd <= 31):
+        return None
+    try:
+        return date(yyyy, mm, dd)  # bleibt nur für 31.02. o. ä.
+    except ValueError:
+        return None
 
+@functools.lru_cache(maxsize=4096)
 def _extract_date_any(txt: str) -> Optional[date]:
-    txt = (txt or "").strip()
-    m = DATE_RX_NUM.search(txt)
-    if m:
-        try:
-            dd, mm, yyyy = int(m.group(1)), int(m.group(2)), int(m.group(3))
-            return date(yyyy, mm, dd)
-        except Exception:
-            pass
-    m2 = DATE_RX_TEXT.search(txt)
-    if m2:
-        try:
-            dd = int(m2.group(1)); mon = m2.group(2).strip().lower(); yyyy = int(m2.group(3))
-            mm = MONTHS_DE.get(mon)
-            if mm: return date(yyyy, mm, dd)
-        except Exception:
-            pass
+    # Gecacht: Wrapper-Knoten (div > a) haben oft exakt denselben Text wie ihr Kind.
+    # Beide Datumsformate brauchen einen Punkt – die meisten Knoten scheiden hier ohne Regex aus
+    if not txt or "." not in txt:
+        return None
+    for m in DATE_RX.finditer(txt):
+        dd, mm, mon, yyyy = m.groups()
+        d = _make_date(int(yyyy), int(mm) if mm else MONTHS_DE.get(mon.lower(), 0), int(dd))
+        if d:
+            return d
     return None
 
-def http_get(url: str) -> Optional[str]:
+def write_atomic(path: Path, text: str):
+    """Datei via Temp-Datei + os.replace schreiben – ein abgebrochener Lauf hinterlässt keinen halben Cache."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    tmp.write_text(text, encoding="utf-8")
+    os.replace(tmp, path)
+
+def http_get(url: str, headers: Optional[Dict[str,str]]=None) -> Optional[requests.Response]:
+    """GET mit stream=True – den Body liest der Aufrufer via read_body()."""
     try:
-        r = requests.get(url, headers={"User-Agent": USER_AGENT}, timeout=REQ_TIMEOUT)
+        r = SESSION.get(url, headers=headers, timeout=REQ_TIMEOUT, stream=True)
         r.raise_for_status()
-        return r.text
+        return r
     except Exception as e:
-        print(f"WARN: GET failed for {url}: {repr(e)}")
+        log.warning("GET failed for %s: %r", url, e)
         return None
 
+def read_body(r: requests.Response, max_bytes: int=MAX_BODY_BYTES) -> bytes:
+    """Body in Blöcken lesen und bei max_bytes abschneiden (begrenzt Peak-Memory)."""
+    buf = bytearray()
+    with r:
+        for chunk in r.iter_content(64 * 1024):
+            buf += chunk
+            if len(buf) >= max_bytes:
+                log.warning("%s grösser als %d Bytes – abgeschnitten", r.url, max_bytes)
+                del buf[max_bytes:]
+                break
+    return bytes(buf)
+
+# Event-Cache: Validatoren (ETag/Last-Modified) + zuletzt geparste Events
+EVENTS_CACHE_PATH = CACHE_DIR / "events.json"
+
+def _events_cache_load(url: str) -> Dict[str, Any]:
+    try:
+        cache = json.loads(EVENTS_CACHE_PATH.read_text(encoding="utf-8"))
+        return cache if cache.get("url") == url else {}
+    except Exception:
+        return {}
+
+def _events_cache_store(url: str, r: requests.Response, events: List[Dict[str,str]], n: int):
+    if not (r.headers.get("ETag") or r.headers.get("Last-Modified")):
+        return
+    try:
+        write_atomic(EVENTS_CACHE_PATH, json.dumps({
+            "url": url,
+            "n": n,  # geparst mit min_events=n – die Liste kann nach n Treffern abbrechen
+            "etag": r.headers.get("ETag", ""),
+            "last_modified": r.headers.get("Last-Modified", ""),
+            "events": events,
+        }, ensure_ascii=False))
+    except Exception as e:
+        log.warning("Event-Cache nicht geschrieben: %r", e)
+
 def fetch_upcoming_events(base_url: str, n=5) -> List[Dict[str,str]]:
     url = f"{base_url}/event/"
-    out: List[Dict[str,str]] = []
-    html_data = http_get(url)
-    if not html_data:
-        return out
-    soup = BeautifulSoup(html_data, "lxml")
+    today_iso = date.today().isoformat()
+
+    # Conditional GET: bei 304 entfallen Download und Parsing komplett
+    cache = _events_cache_load(url)
+    # Mit kleinerem n geparst → Liste evtl. unvollständig (Scan früh beendet): Validatoren nicht senden
+    if cache.get("n", 0) < n:
+        cache = {}
+    headers = {}
+    if cache.get("etag"):
+        headers["If-None-Match"] = cache["etag"]
+    if cache.get("last_modified"):
+        headers["If-Modified-Since"] = cache["last_modified"]
+
+    r = http_get(url, headers)
+    if r is None:
+        return []
+    if r.status_code == 304:
+        r.close()
+        log.info("Event-Seite unverändert (304) – Events aus Cache")
+        events = [e for e in cache.get("events", []) if e.get("date_iso","") >= today_iso]
+    else:
+        body = read_body(r)
+        # Charset aus dem HTTP-Header an lxml weitergeben, sonst erkennt lxml es aus <meta>
+        encoding = r.encoding if "charset" in r.headers.get("Content-Type", "").lower() else None
+        events = _parse_events(body, url, encoding, min_events=n) if body.strip() else []
+        _events_cache_store(url, r, events, n)
+    return events[:n]
+
+@functools.lru_cache(maxsize=4)
+def _html_parser(encoding: Optional[str]) -> lh.HTMLParser:
+    """Parser je Encoding wiederverwenden. Kommentare/PIs gar nicht erst als Knoten anlegen,
+    keine ID-Tabelle (wird nie abgefragt)."""
+    return lh.HTMLParser(encoding=encoding, remove_comments=True, remove_pis=True, collect_ids=False)
+
+def _parse_events(html_data: bytes, url: str, encoding: Optional[str]=None, min_events: int=0) -> List[Dict[str,str]]:
+    """Zukünftige Events der Seite, dedupliziert und nach Datum sortiert.
+    Reicht JSON-LD (schema.org/Event) für ``min_events``, entfällt das DOM-Scraping ganz;
+    liefern <time>-Tags und Event-Karten schon ``min_events`` Treffer, entfällt der generische Scan."""
+    doc = lh.fromstring(html_data, parser=_html_parser(encoding))
     today = date.today()
-    candidates = []
+    # Dedup schon beim Einfügen: Duplikate (Kind + Eltern, <time> + Karte, JSON-LD + DOM) landen gar
+    # nicht erst in der Sortierung. Ein echter Event-Link identifiziert das Event (Titeltext variiert je
+    # nach Pass); nur beim Fallback auf die Übersichts-URL unterscheidet der Titel.
+    linked: Dict[Tuple[str, str], Dict[str,str]] = {}
+    fallback: Dict[Tuple[str, str], Dict[str,str]] = {}
+    def add(d: date, title: str, href: str):
+        d_iso = d.isoformat()
+        bucket, key = (fallback, (d_iso, title[:80])) if href == url else (linked, (d_iso, href))
+        if key not in bucket:
+            bucket[key] = {"date_iso": d_iso, "title": title, "url": href}
+    def unique() -> List[Dict[str,str]]:
+        # Fallback-Treffer am Tag eines verlinkten Events sind dasselbe Event ohne Link (z. B. <time> im Datums-Wrapper)
+        linked_dates = {k[0] for k in linked}
+        return list(linked.values()) + [it for k, it in fallback.items() if k[0] not in linked_dates]
+
+    # JSON-LD zuerst (vor dem Entfernen der <script>-Tags): exakte Daten ohne Regex-Heuristik
+    for raw in JSONLD_XP(doc):
+        try:
+            data = json.loads(raw)
+        except ValueError:
+            continue
+        for ev in _iter_jsonld_events(data):
+            start, name = ev.get("startDate"), ev.get("name")
+            if not isinstance(start, str) or not isinstance(name, str):
+                continue
+            try:
+                d = date.fromisoformat(start[:10])
+            except ValueError:
+                continue
+            if d < today:
+                continue
+            href = ev.get("url")
+            add(d, " ".join(html.unescape(name).split())[:220], _abs_url(url, href) if isinstance(href, str) and href else url)
+    events = unique()
+    if events and len(events) >= min_events:
+        return sorted(events, key=lambda it: it["date_iso"])
+
+    etree.strip_elements(doc, "script", "style", with_tail=False)
+
+    # Text/Datum pro Knoten nur einmal bilden – Eltern werden sonst von jedem Kind erneut ausgewertet
+    texts: Dict[Any, str] = {}
+    dates: Dict[Any, Optional[date]] = {}
+    def text_of(el) -> str:
+        if el not in texts:
+            texts[el] = _text(el)
+        return texts[el]
+    def date_of(el) -> Optional[date]:
+        if el not in dates:
+            dates[el] = _extract_date_any(text_of(el))
+        return dates[el]
 
     # <time datetime="YYYY-MM-DD"> bevorzugen
-    for t in soup.find_all("time"):
+    for t in TIME_XP(doc):
         d_iso = (t.get("datetime") or "").strip()
         d = None
         if d_iso:
             try:
-                d = datetime.fromisoformat(d_iso[:10]).date()
-            except Exception:
+                d = date.fromisoformat(d_iso[:10])
+            except ValueError:
                 d = None
         if not d:
-            d = _extract_date_any(t.get_text(" ", strip=True))
+            d = date_of(t)
         if not d or d < today:
             continue
-        parent = t.find_parent(["article","li","div","section"]) or t
-        a = parent.find("a", href=True) or t.find("a", href=True)
-        href = a["href"] if a else None
-        title = " ".join((parent.get_text(" ", strip=True) or "").split())[:220]
+        parents = PARENT_XP(t)
+        parent = parents[0] if parents else t
+        hrefs = HREF_XP(parent) or HREF_XP(t)
+        href = hrefs[0] if hrefs else None
+        title = text_of(parent)[:220]
         if href:
-            href = requests.compat.urljoin(url, href)
-        candidates.append({"date_iso": d.isoformat(), "title": title, "url": href or url})
+            href = _abs_url(url, href)
+        add(d, title, href or url)
 
-    # generische Kandidaten
-    for tag in soup.find_all(["article","li","div","span","a","dd","dt"]):
-        txt = " ".join((tag.get_text(" ", strip=True) or "").split())
-        d = _extract_date_any(txt) or _extract_date_any(" ".join((tag.parent.get_text(" ", strip=True) or "").split()) if tag.parent else "")
+    # Event-Karten: Datum und Link aus der Karte selbst
+    for card in CARD_XP(doc):
+        d = date_of(card)
+        if not d or d < today:
+            continue
+        hrefs = HREF_XP(card)
+        href = _abs_url(url, hrefs[0]) if hrefs else url
+        add(d, text_of(card)[:220], href)
+
+    # generische Kandidaten – teurer Scan über (fast) alle Knoten, nur wenn die Karten nicht reichen
+    for tag in (GENERIC_XP(doc) if len(unique()) < min_events else ()):
+        txt = text_of(tag)
+        parent = tag.getparent()
+        d = date_of(tag) or (date_of(parent) if parent is not None else None)
         if not d or d < today:
             continue
-        a = tag if (tag.name == "a" and tag.has_attr("href")) else tag.find("a", href=True)
-        href = a["href"] if a else None
+        if tag.tag == "a" and tag.get("href") is not None:
+            href = tag.get("href")
+        else:
+            hrefs = HREF_XP(tag)
+            href = hrefs[0] if hrefs else None
         if href:
-            href = requests.compat.urljoin(url, href)
+            href = _abs_url(url, href)
         title = txt[:220]
-        candidates.append({"date_iso": d.isoformat(), "title": title, "url": href or url})
+        add(d, title, href or url)
 
-    seen = set()
-    for e in sorted(candidates, key=lambda it: it["date_iso"]):
-        key = (e["date_iso"], e.get("url",""), e.get("title","")[:80])
-        if key in seen: 
-            continue
-        seen.add(key)
-        out.append(e)
-        if len(out) >= n:
-            break
-    return out
+    return sorted(unique(), key=lambda it: it["date_iso"])
+
+MONTH_NAMES_DE = ("Januar","Februar","März","April","Mai","Juni","Juli","August","September","Oktober","November","Dezember")
 
 def ch_date_str(d: date, with_time: Optional[datetime]=None) -> str:
-    months = ["Januar","Februar","März","April","Mai","Juni","Juli","August","September","Oktober","November","Dezember"]
-    base = f"{d.day}. {months[d.month-1]} {d.year}"
+    base = f"{d.day}. {MONTH_NAMES_DE[d.month-1]} {d.year}"
     if with_time is not None:
-        base += with_time.strftime(", %H:%M")
+        base += f", {with_time.hour:02d}:{with_time.minute:02d}"
     return base
 
+@functools.lru_cache(maxsize=512)
+def ch_date_from_iso(s: str) -> str:
+    """'YYYY-MM-DD' → '12. März 2026'; unparsebare Werte unverändert. Gecacht, da Daten sich oft wiederholen."""
+    try:
+        return ch_date_str(date.fromisoformat(s))
+    except ValueError:
+        return s
+
 # ================== OpenAI Call ==================
 SYSTEM_TEXT = (
     "Du bist ein präziser, faktenorientierter Redakteur für Schweizer Vermögensverwalter (UVV/EAM). "
@@ -300,161 +518,280 @@ Zusatzregel:
 Nach dem offiziellen Titel soll jeweils ein kurzer, prägnanter Hinweis ergänzt werden, warum der Event relevant ist (z. B. „mit Fokus auf FINMA-Regulierung“, „inkl. Praxisbeispielen aus der Aufsicht“, „Networking-Gelegenheit für EAM“). Der Hinweis soll maximal 8 Wörter haben und in den Titel integriert sein, durch Doppelpunkt oder Bindestrich getrennt.
 """
 
-def ask_openai_html() -> str:
-    from openai import OpenAI
-    client = OpenAI(api_key=OPENAI_API_KEY, timeout=OPENAI_REQUEST_TIMEOUT_S)
+# Nachrichtenliste ist konstant – einmal beim Import bauen statt pro Versuch
+PROMPT_MESSAGES = [
+    {"role": "system", "content": SYSTEM_TEXT},
+    {"role": "user", "content": PROMPT_TEXT},
+]
 
-    messages = [
-        {"role": "system", "content": SYSTEM_TEXT},
-        {"role": "user", "content": PROMPT_TEXT},
-    ]
+# Bei inhaltlichen Prompt-Änderungen hochzählen → alte Cache-Einträge werden ignoriert
+PROMPT_VERSION = "v1"
 
-    kwargs: Dict[str, Any] = {"model": OPENAI_MODEL, "input": messages}
-    if USE_WEBSEARCH:
-        kwargs["tools"] = [{"type":"web_search"}]  # kein tool_choice setzen!
+def _openai_cache_path(kwargs: Dict[str, Any]) -> Path:
+    # In der Action an die Run-ID gebunden: nur Re-Runs desselben Laufs treffen den Cache,
+    # ein neuer Lauf (Schedule oder "Run workflow") fragt immer neu an. Lokal ist die ID leer.
+    run_id = os.getenv("GITHUB_RUN_ID", "")
+    key_src = json.dumps({"prompt_version": PROMPT_VERSION, "run_id": run_id, **kwargs}, sort_keys=True, ensure_ascii=False)
+    key = hashlib.sha256(key_src.encode("utf-8")).hexdigest()
+    return CACHE_DIR / "openai" / f"{key}.json"
+
+def _openai_cache_load(path: Path) -> Optional[str]:
+    try:
+        if time.time() - path.stat().st_mtime > OPENAI_CACHE_TTL_S:
+            return None
+        return json.loads(path.read_text(encoding="utf-8")).get("text") or None
+    except Exception:
+        return None
+
+def _openai_cache_store(path: Path, text: str):
+    try:
+        write_atomic(path, json.dumps({"model": OPENAI_MODEL, "text": text}, ensure_ascii=False))
+        # Abgelaufene Einträge früherer Läufe entfernen (ein Eintrag pro Run-ID, sonst wächst der Cache)
+        now = time.time()
+        for old in path.parent.glob("*.json"):
+            if now - old.stat().st_mtime > OPENAI_CACHE_TTL_S:
+                old.unlink(missing_ok=True)
+    except Exception as e:
+        log.warning("OpenAI-Cache nicht geschrieben: %r", e)
 
-    resp = client.responses.create(**kwargs)
+@functools.lru_cache(maxsize=1)
+def openai_client():
+    """Ein Client pro Prozess: Retries im main()-Loop nutzen denselben httpx-Pool.
+    Import erst hier – bei Cache-Treffer wird das openai-Paket gar nicht geladen."""
+    from openai import OpenAI
+    return OpenAI(api_key=OPENAI_API_KEY, timeout=OPENAI_REQUEST_TIMEOUT_S)
+
+def ask_openai_html(use_websearch: bool=USE_WEBSEARCH) -> str:
+    kwargs: Dict[str, Any] = {"model": OPENAI_MODEL, "input": PROMPT_MESSAGES}
+    if use_websearch:
+        kwargs["tools"] = [{"type":"web_search"}]  # kein tool_choice setzen!
 
-    # Best-effort: Tool-Nutzung loggen (falls vorhanden)
+    # Re-Runs derselben Woche (z. B. nach WP-Fehler) nicht erneut bezahlen
+    cache_path = _openai_cache_path(kwargs)
+    cached = _openai_cache_load(cache_path) if OPENAI_CACHE else None
+    if cached:
+        log.info("OpenAI-Antwort aus Cache (%s…)", cache_path.name[:12])
+        return cached
+
+    client = openai_client()
+    # Streaming mit harter Gesamt-Deadline: der Client-Timeout gilt nur pro Lesevorgang, ein Check
+    # pro Event greift bei stillem Stream nicht, und stream.close() aus einem anderen Thread löst ein
+    # blockierendes Lesen nicht. Deshalb liest ein Daemon-Thread den Stream; wir warten höchstens
+    # OPENAI_REQUEST_TIMEOUT_S und setzen danach ``stop``: beim nächsten Event bricht der Thread ab und
+    # das Verlassen des with-Blocks schließt die Verbindung (sonst liefe die bezahlte Generierung neben
+    # dem Retry weiter). Nur ein Stream, der gar nichts mehr sendet, endet erst per Read-Timeout.
+    state: Dict[str, Any] = {"tool_uses": 0}
+    def _consume(stop: threading.Event):
+        try:
+            with client.responses.stream(**kwargs) as stream:
+                for event in stream:
+                    if stop.is_set():
+                        return
+                    if event.type == "response.web_search_call.completed":
+                        state["tool_uses"] += 1
+                state["resp"] = stream.get_final_response()
+        except Exception as e:
+            state["error"] = e
+    stop = threading.Event()
+    worker = threading.Thread(target=_consume, args=(stop,), name="openai-stream", daemon=True)
+    worker.start()
+    worker.join(OPENAI_REQUEST_TIMEOUT_S)
+    if worker.is_alive():
+        stop.set()
+        raise TimeoutError(f"OpenAI-Antwort nach {OPENAI_REQUEST_TIMEOUT_S}s nicht vollständig")
+    if "error" in state:
+        raise state["error"]
+    resp, tool_uses = state["resp"], state["tool_uses"]
+
+    # Best-effort: Tool-Nutzung und Token loggen
     try:
-        tool_uses = 0
-        if hasattr(resp, "output") and isinstance(resp.output, list):
-            for block in resp.output:
-                if getattr(block, "type", "") == "tool_call":
-                    tool_uses += 1
-        print(f"INFO: erkannte Tool-Aufrufe: {tool_uses}", file=sys.stderr)
+        log.info("erkannte Tool-Aufrufe: %d", tool_uses)
+        # Prompt ist komplett statisch (kein variabler Teil vorne) → OpenAI-Prefix-Cache greift bei Re-Runs
+        usage = getattr(resp, "usage", None)
+        if usage is not None:
+            cached_tokens = getattr(getattr(usage, "input_tokens_details", None), "cached_tokens", 0) or 0
+            log.info("Input-Tokens: %s (davon aus Prompt-Cache: %s)", usage.input_tokens, cached_tokens)
     except Exception:
         pass
 
-    text = getattr(resp, "output_text", "") or ""
-    return text.strip()
+    text = (getattr(resp, "output_text", "") or "").strip()
+    if text and OPENAI_CACHE:
+        _openai_cache_store(cache_path, text)
+    return text
 
 # ================== Postprocessing: Events anhängen/ersetzen ==================
-def ensure_next_events_section(model_html: str, base_url: str) -> str:
+# Attribute tolerieren (<h3 class="…">, <li class="…">) – sonst wird eine gefüllte Sektion als fehlend
+# erkannt und unnötig gescrapt/ersetzt
+NEXT_EVENTS_H3_RX    = re.compile(r"<h3\b[^>]*>\s*Next Events\s*</h3>", re.IGNORECASE)
+NEXT_EVENTS_BLOCK_RX = re.compile(r"<h3\b[^>]*>\s*Next Events\s*</h3>(\s*<ul\b[^>]*>.*?</ul>)?", re.IGNORECASE|re.DOTALL)
+LI_RX                = re.compile(r"<li\b[^>]*>.*?</li>", re.IGNORECASE|re.DOTALL)
+HEADER_STAND_RX      = re.compile(
+    r"(<h1>\s*Weekly-Updates\s*–\s*Stand:\s*)(\[.*?\]|\d{1,2}\.\s*[A-Za-zäöüÄÖÜ]+?\s*\d{4},\s*\d{2}:\d{2})(\s*</h1>)",
+    re.IGNORECASE)
+H1_WEEKLY_RX         = re.compile(r"<h1>.*Weekly-Updates", re.IGNORECASE)
+
+def render_event_li(e: Dict[str,str]) -> str:
+    dpretty = ch_date_from_iso(e.get("date_iso","")[:10])
+    title = html.escape((e.get("title") or "Event").strip())
+    url = html.escape((e.get("url") or "").strip())
+    return f'<li>{dpretty} – {title} (<a href="{url}" target="_blank" rel="noopener">Link</a>)</li>'
+
+def ensure_next_events_section(model_html: str, base_url: str, events: Optional[List[Dict[str,str]]]=None) -> str:
     """Falls das Modell keine <h3>Next Events</h3>-Sektion erzeugt hat,
-    oder die Liste leer ist, ergänzen wir sie via Scraper."""
-    has_section = re.search(r"<h3>\s*Next Events\s*</h3>", model_html, re.IGNORECASE) is not None
-    need_append = (not has_section)
-
-    if not need_append:
-        # Prüfen, ob direkt danach eine UL mit Li kommt
-        after = re.search(r"(<h3>\s*Next Events\s*</h3>)(?P<tail>.*)", model_html, re.IGNORECASE|re.DOTALL)
-        if after:
-            tail = after.group("tail")
-            # falls keine <li> gefunden → als leer betrachten
-            if re.search(r"<li>.*?</li>", tail, re.IGNORECASE|re.DOTALL) is None:
-                need_append = True
-        else:
-            need_append = True
-
-    if not need_append:
+    oder die Liste leer ist, ergänzen wir sie via Scraper.
+    Bereits geladene Events (``events``) werden direkt verwendet."""
+    head = NEXT_EVENTS_H3_RX.search(model_html)
+    has_section = head is not None
+    # Sektion vorhanden und danach mindestens ein <li> → nichts zu tun (Suche ab Ende der Überschrift)
+    if has_section and LI_RX.search(model_html, head.end()) is not None:
         return model_html
 
-    ev = fetch_upcoming_events(base_url, EVENTS_COUNT)
+    ev = events
+    if ev is None:
+        ev = fetch_upcoming_events(base_url, EVENTS_COUNT) if EVENTS_COUNT > 0 else []
     if not ev:
         # Nichts zu ergänzen
         return model_html
 
-    lines = []
-    lines.append("<h3>Next Events</h3>")
-    lines.append("<ul>")
-    for e in ev:
-        dtxt = e.get("date_iso","")[:10]
-        # Datum hübsch machen
-        try:
-            d = datetime.strptime(dtxt, "%Y-%m-%d").date()
-            dpretty = ch_date_str(d)
-        except Exception:
-            dpretty = dtxt
-        title = html.escape((e.get("title") or "Event").strip())
-        url = html.escape((e.get("url") or "").strip())
-        lines.append(f'<li>{dpretty} – {title} (<a href="{url}" target="_blank" rel="noopener">Link</a>)</li>')
-    lines.append("</ul>")
-
+    block = "\n".join(["<h3>Next Events</h3>", "<ul>", *map(render_event_li, ev), "</ul>"])
     if has_section:
-        # vorhandene (leere) Sektion ersetzen
-        model_html = re.sub(r"(<h3>\s*Next Events\s*</h3>)(\s*<ul>.*?</ul>)?",
-                            "\n".join(lines),
-                            model_html, flags=re.IGNORECASE|re.DOTALL)
+        # vorhandene (leere) Sektion ersetzen; Funktion statt Ersetzungs-String,
+        # damit Backslashes in Event-Titeln nicht als Escapes gelten
+        model_html = NEXT_EVENTS_BLOCK_RX.sub(lambda _m: block, model_html)
     else:
         # ans Ende hängen
-        model_html = model_html.rstrip() + "\n" + "\n".join(lines)
+        model_html = model_html.rstrip() + "\n" + block
     return model_html
 
 # ================== WP Endpoint ==================
+WP_HASH_PATH = CACHE_DIR / "wp_posted.sha256"
+STAND_RX = re.compile(r"(Stand:\s*)[^<]*")
+
+def _wp_content_hash(url: str, html_inner: str) -> str:
+    # Zeitstempel in "Stand: …" ignorieren – sonst wäre jeder Lauf eine Änderung
+    content = STAND_RX.sub(r"\g<1>", html_inner.strip(), count=1)
+    return hashlib.sha256(f"{url}\n{content}".encode("utf-8")).hexdigest()
+
 def post_to_wp(html_inner: str):
     url = f"{WP_BASE}/wp-json/iguv/v1/weekly"
+    content_hash = _wp_content_hash(url, html_inner)
+    if WP_SKIP_UNCHANGED:
+        try:
+            if WP_HASH_PATH.read_text(encoding="utf-8").strip() == content_hash:
+                log.info("SKIP: Inhalt unverändert seit letztem Update – kein POST")
+                return
+        except OSError:
+            pass
     headers = {
-        "User-Agent": USER_AGENT,
         "Accept": "application/json",
-        "Content-Type": "application/json",
+        "Content-Type": "application/json; charset=utf-8",
     }
     if WP_API_TOKEN:
         headers["X-IGUV-Token"] = WP_API_TOKEN
 
-    r = requests.post(
-        url,
-        auth=(WP_USERNAME, WP_APP_PASSWORD) if WP_USERNAME and WP_APP_PASSWORD else None,
-        json={"html": html_inner.strip()},
-        headers=headers,
-        timeout=REQ_TIMEOUT
-    )
+    # Einmal direkt nach UTF-8 serialisieren (ohne \uXXXX-Escapes für Umlaute/Gedankenstriche)
+    body = json.dumps({"html": html_inner.strip()}, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    auth = (WP_USERNAME, WP_APP_PASSWORD) if WP_USERNAME and WP_APP_PASSWORD else None
+
+    def _post(data: bytes, hdrs: Dict[str,str]) -> requests.Response:
+        return SESSION.post(url, auth=auth, data=data, headers=hdrs, timeout=REQ_TIMEOUT)
+
+    if WP_GZIP and len(body) > 4096:
+        # HTML komprimiert ~5-10×; nicht jeder Server entpackt Request-Bodies → Fallback unkomprimiert
+        r = _post(gzip.compress(body, 6), {**headers, "Content-Encoding": "gzip"})
+        if r.status_code in (400, 415):
+            log.warning("WP akzeptiert gzip nicht (%s) – sende unkomprimiert", r.status_code)
+            r = _post(body, headers)
+    else:
+        r = _post(body, headers)
+
     if r.status_code not in (200, 201):
         raise RuntimeError(f"WP Update fehlgeschlagen: {r.status_code} {r.text}")
-    print("SUCCESS: Weekly HTML via Endpoint gesetzt.")
+    log.info("SUCCESS: Weekly HTML via Endpoint gesetzt.")
+    try:
+        write_atomic(WP_HASH_PATH, content_hash)
+    except OSError as e:
+        log.warning("WP-Hash nicht geschrieben: %r", e)
 
 # ================== MAIN ==================
+def _retry_after_s(err: Exception) -> Optional[float]:
+    """Retry-After (Sekunden) aus einer OpenAI-APIStatusError-Antwort, sonst None."""
+    headers = getattr(getattr(err, "response", None), "headers", None)
+    try:
+        return min(float(headers.get("retry-after")), RETRY_AFTER_MAX_S) if headers else None
+    except (TypeError, ValueError):
+        return None  # fehlt oder HTTP-Datum
+
+def _is_retriable(err: Exception) -> bool:
+    """4xx der OpenAI-API (ausser 408/409/429) sind Konfigurations-/Request-Fehler: Retry bringt nichts."""
+    status = getattr(err, "status_code", None)
+    return not (isinstance(status, int) and 400 <= status < 500 and status not in (408, 409, 429))
+
 def main():
-    print("== IGUV Prompt-Weekly startet ==")
-    print(f"Modell: {OPENAI_MODEL} | Timeout: {OPENAI_REQUEST_TIMEOUT_S}s | Websuche: {'AN' if USE_WEBSEARCH else 'AUS'}")
+    log.info("== IGUV Prompt-Weekly startet ==")
+    log.info("Modell: %s | Timeout: %ss | Websuche: %s", OPENAI_MODEL, OPENAI_REQUEST_TIMEOUT_S, "AN" if USE_WEBSEARCH else "AUS")
     require_env()
 
+    # Event-Seite parallel zum (langen) OpenAI-Call laden – Latenz verschwindet dahinter
+    events_future = None
+    if EVENTS_COUNT > 0:
+        pool = ThreadPoolExecutor(max_workers=1)
+        events_future = pool.submit(fetch_upcoming_events, WP_BASE, EVENTS_COUNT)
+        pool.shutdown(wait=False)
+
     # Retries mit Exponential Backoff
     max_retries = 3
     backoff = 10
     last_err = None
     model_html = ""
     for attempt in range(1, max_retries+1):
+        use_ws = USE_WEBSEARCH and not (WEBSEARCH_FALLBACK and attempt == max_retries)
+        if use_ws != USE_WEBSEARCH:
+            log.warning("Letzter Versuch ohne Websuche (OPENAI_NO_WEBSEARCH_FALLBACK)")
         try:
-            model_html = ask_openai_html()
+            model_html = ask_openai_html(use_websearch=use_ws)
             if not model_html:
                 raise RuntimeError("Leere Antwort vom Modell.")
             break
         except Exception as e:
             last_err = e
-            if attempt == max_retries:
+            if attempt == max_retries or not _is_retriable(e):
                 raise
-            print(f"WARN: OpenAI-Versuch {attempt} fehlgeschlagen: {repr(e)} – retry in {backoff}s")
-            time.sleep(backoff)
-            backoff *= 2
+            # Retry-After (z. B. bei 429) hat Vorrang; sonst Jitter, damit parallele Runner nicht synchron retryen
+            wait_s = _retry_after_s(e) or random.uniform(backoff / 2, backoff)
+            log.warning("OpenAI-Versuch %d fehlgeschlagen: %r – retry in %.0fs", attempt, e, wait_s)
+            time.sleep(wait_s)
+            backoff = min(backoff * 2, 120)
 
     # Falls Next-Events fehlen/leer → via Scraper ergänzen
     try:
-        model_html = ensure_next_events_section(model_html, WP_BASE)
+        events = events_future.result() if events_future else []
+        model_html = ensure_next_events_section(model_html, WP_BASE, events)
     except Exception as e:
-        print("WARN: ensure_next_events_section:", repr(e))
+        log.warning("ensure_next_events_section: %r", e)
 
     # Kopfzeile ggf. mit aktuellem Zeitstempel ersetzen/ergänzen
     now = datetime.now()
     now_txt = ch_date_str(now.date(), with_time=now)
-    model_html = re.sub(
-        r"(<h1>\s*Weekly-Updates\s*–\s*Stand:\s*)(\[.*?\]|\d{1,2}\.\s*[A-Za-zäöüÄÖÜ]+?\s*\d{4},\s*\d{2}:\d{2})(\s*</h1>)",
-        rf"\1{now_txt}\3",
-        model_html,
-        flags=re.IGNORECASE
-    )
-    if not re.search(r"<h1>.*Weekly-Updates", model_html, re.IGNORECASE):
+    # Ohne <h1> (str-Suche in C) direkt voranstellen – beide Regex-Scans entfallen
+    if "<h1" not in model_html and "<H1" not in model_html:
         model_html = f"<h1>Weekly-Updates – Stand: {now_txt}</h1>\n" + model_html
+    else:
+        # Funktion statt rf"\1{now_txt}\3": sonst wird "\1" + "15. …" zur Gruppe 115 bzw. zum Oktal-Escape
+        model_html = HEADER_STAND_RX.sub(lambda m: m.group(1) + now_txt + m.group(3), model_html, count=1)
+        if not H1_WEEKLY_RX.search(model_html):
+            model_html = f"<h1>Weekly-Updates – Stand: {now_txt}</h1>\n" + model_html
 
-    print("WordPress aktualisieren …")
+    log.info("WordPress aktualisieren …")
     post_to_wp(model_html)
 
-    print("== Fertig ==")
+    log.info("== Fertig ==")
 
 if __name__ == "__main__":
+    # Einheitliches Format mit Zeitstempel; Meldungen und Tracebacks im selben Stream (Action-Log)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s", stream=sys.stdout)
     try:
         main()
     except Exception as e:
-        print("ERROR:", repr(e))
-        traceback.print_exc()
+        log.exception("ERROR: %r", e)
         sys.exit(2)